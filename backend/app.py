@@ -1,15 +1,55 @@
 import os
+import hmac
 import time
+import uuid
+import queue
+import httpx
+import orjson
 import requests
+import posixpath
 import threading
+from io import BytesIO
+from blake3 import blake3
+from cachetools import TTLCache
+from urllib.parse import quote, unquote, urlsplit
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt import MultipartEncoder
+from PIL import Image, ImageOps, UnidentifiedImageError
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from supabase import create_client, Client
+from flask_compress import Compress
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+# orjson is considerably faster than the stdlib json module for the
+# small payloads every endpoint returns.
+class OrjsonProvider(JSONProvider):
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Reject oversized uploads before they are spooled to disk
+app.config["MAX_CONTENT_LENGTH"] = 20 * 1024 * 1024
+
+# Compress JSON responses only; images are never returned from here
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+Compress(app)
 
 # ✅ CORS for Vercel frontend
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
@@ -24,6 +64,10 @@ MODEL_URL = os.getenv("MODEL_URL")
 # 📱 TELEGRAM CONFIG
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+# 🔐 Shared secret the upload-image edge function sends as X-Colab-Secret
+BACKEND_SECRET_KEY = os.getenv("BACKEND_SECRET_KEY", "")
 
 if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
     raise Exception("Supabase env variables missing")
@@ -31,10 +75,509 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
 if not MODEL_URL:
     raise Exception("MODEL_URL missing")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-
 BUCKET_NAME = "captured-images"
 
+
+# Public bucket URLs are deterministic, so build them locally instead of
+# going through the storage client.
+def public_url(bucket, name):
+    return f"{SUPABASE_URL}/storage/v1/object/public/{bucket}/{quote(name, safe='/')}"
+
+
+BUCKET_URL_PREFIX = public_url(BUCKET_NAME, "")
+BUCKET_URL_PARTS = urlsplit(BUCKET_URL_PREFIX)
+
+
+# True only for a plain object URL in our own bucket. A bare prefix
+# check would let "../" segments (raw or percent-encoded), queries or
+# fragments point the fetch somewhere else on the Supabase host.
+def is_bucket_url(url):
+    if not isinstance(url, str) or "?" in url or "#" in url:
+        return False
+
+    parts = urlsplit(url)
+
+    if (parts.scheme, parts.netloc) != (BUCKET_URL_PARTS.scheme, BUCKET_URL_PARTS.netloc):
+        return False
+
+    path = unquote(parts.path)
+
+    if "\\" in path or posixpath.normpath(path) != path:
+        return False
+
+    return path.startswith(BUCKET_URL_PARTS.path) and path != BUCKET_URL_PARTS.path
+
+# =========================
+# 🔌 SHARED HTTP SESSION
+# =========================
+# One pooled keep-alive session for the model, Telegram and self calls,
+# so the TLS handshake is paid once per connection instead of per request.
+MODEL_POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", 50))
+
+SESSION = requests.Session()
+SESSION.headers["Connection"] = "keep-alive"
+
+_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=MODEL_POOL_SIZE,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 502, 503, 504]
+    )
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+
+# Streams a file-like object as the "image" multipart field instead of
+# buffering the whole image in memory before sending it.
+def post_image(url, filename, stream, mimetype, timeout=None):
+    encoder = MultipartEncoder(
+        fields={"image": (filename, stream, mimetype)}
+    )
+
+    return SESSION.post(
+        url,
+        data=encoder,
+        headers={"Content-Type": encoder.content_type},
+        timeout=timeout
+    )
+
+
+# Exposes the bytes still to be read from a streamed response body, which
+# MultipartEncoder needs to frame the part without buffering it.
+class SizedStream:
+
+    def __init__(self, raw, length):
+        self.raw = raw
+        self.len = length
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size if size >= 0 else self.len) or b""
+        self.len -= len(chunk)
+        return chunk
+
+# =========================
+# ⚙️ BACKGROUND WORKERS
+# =========================
+# Webhook jobs run here so the HTTP call returns immediately; the
+# semaphore caps concurrent calls into the model so we don't flood it.
+WORKERS = int(os.getenv("WORKERS", 16))
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", 8))
+
+EXECUTOR = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="webhook")
+MODEL_SEMAPHORE = threading.BoundedSemaphore(MODEL_CONCURRENCY)
+
+# Telegram alerts from /predict share a small fixed pool instead of
+# spawning a thread per request.
+ALERT_WORKERS = int(os.getenv("ALERT_WORKERS", 4))
+ALERT_POOL = ThreadPoolExecutor(max_workers=ALERT_WORKERS, thread_name_prefix="alert")
+
+# Storage uploads from /save-history overlap with the database inserts.
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", 8))
+STORAGE_POOL = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage")
+
+# Webhook jobs waiting beyond this are rejected with 503 so callers back
+# off; alerts beyond it are dropped.
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", 100))
+
+
+def queue_full(pool, incoming=1):
+    return pool._work_queue.qsize() + incoming > MAX_QUEUE
+
+# =========================
+# 🗄️ SUPABASE CONNECTION POOL
+# =========================
+# Every pooled client shares one keep-alive HTTP/2 httpx client, so REST
+# and Storage calls are multiplexed over a few TLS connections, and the
+# pool size caps in-flight Supabase requests below the project's
+# connection limit. Clients hold no connections of their own, so idle
+# ones are simply kept for reuse.
+class SupabaseConnectionPool:
+
+    def __init__(self, url, key, size, min_size=2):
+        self.url = url
+        self.key = key
+
+        self.http_client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_keepalive_connections=10,
+                max_connections=20
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            headers={"Accept-Encoding": "gzip, br"}
+        )
+        self.options = ClientOptions(
+            httpx_client=self.http_client,
+            persist_session=False,
+            auto_refresh_token=False
+        )
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+        for _ in range(min(min_size, size)):
+            self._idle.put(self._create())
+
+    def _create(self) -> Client:
+        return create_client(self.url, self.key, options=self.options)
+
+    def _checkout(self) -> Client:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._create()
+
+    @contextmanager
+    def acquire(self):
+        with self._slots:
+            client = self._checkout()
+            try:
+                yield client
+            finally:
+                self._idle.put(client)
+
+
+# Created on first use rather than at import. The lock makes sure
+# threads racing on the first request share one pool (and one httpx
+# client) instead of each building their own.
+_SUPABASE_POOL = None
+_SUPABASE_POOL_LOCK = threading.Lock()
+
+
+def get_supabase_pool() -> SupabaseConnectionPool:
+    global _SUPABASE_POOL
+
+    if _SUPABASE_POOL is None:
+        with _SUPABASE_POOL_LOCK:
+            if _SUPABASE_POOL is None:
+                _SUPABASE_POOL = SupabaseConnectionPool(
+                    SUPABASE_URL,
+                    SUPABASE_SERVICE_KEY,
+                    size=int(os.getenv("SUPABASE_POOL_SIZE", WORKERS * 2))
+                )
+
+    return _SUPABASE_POOL
+
+# =========================
+# 📦 MICRO-BATCHING
+# =========================
+# Collects items submitted from many threads and hands them to flush_fn
+# in batches of up to max_batch, waiting at most max_wait_ms for a batch
+# to fill. flush_fn returns one result per item; an Exception in that
+# list is raised to that item's caller. With a flush_pool, batches are
+# flushed on it so the next batch can form while one is in flight.
+class MicroBatcher:
+
+    def __init__(self, flush_fn, max_batch, max_wait_ms, name, flush_pool=None):
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.flush_pool = flush_pool
+
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _flush(self, batch):
+        # Callers that timed out cancel their future; skip those items.
+        batch = [
+            (item, future) for item, future in batch
+            if future.set_running_or_notify_cancel()
+        ]
+
+        if not batch:
+            return
+
+        try:
+            results = self.flush_fn([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+
+            if self.flush_pool is None:
+                self._flush(batch)
+            else:
+                self.flush_pool.submit(self._flush, batch)
+
+# =========================
+# 🗃️ PREDICTION CACHE
+# =========================
+# Retried webhooks and repeated uploads reuse the earlier model response.
+# Uploads are keyed by a BLAKE3 hash of their content. Webhook jobs are
+# keyed by image URL, which is only safe because process_image accepts
+# nothing but URLs in our own bucket (is_bucket_url), and objects
+# there are uploaded with upsert off, so a URL never changes content.
+PREDICTION_CACHE = TTLCache(
+    maxsize=int(os.getenv("PREDICTION_CACHE_SIZE", 10_000)),
+    ttl=int(os.getenv("PREDICTION_CACHE_TTL", 24 * 3600))
+)
+PREDICTION_CACHE_LOCK = threading.Lock()
+
+
+def get_cached_prediction(key):
+    with PREDICTION_CACHE_LOCK:
+        return PREDICTION_CACHE.get(key)
+
+
+def cache_prediction(key, prediction):
+    with PREDICTION_CACHE_LOCK:
+        PREDICTION_CACHE[key] = prediction
+
+
+# /predict responses by Idempotency-Key, so client retries don't re-run
+# inference or re-send alerts. Each entry keeps the hash of the image it
+# answered, and a key reused with a different image is rejected.
+# The cache lives in one worker process: with several gunicorn workers a
+# retry that lands on another worker runs again (the prediction cache
+# still spares the model call, but the alert is re-sent).
+IDEMPOTENCY_CACHE = TTLCache(
+    maxsize=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10_000)),
+    ttl=int(os.getenv("IDEMPOTENCY_TTL", 300))
+)
+IDEMPOTENCY_LOCK = threading.Lock()
+
+
+def hash_stream(stream):
+    hasher = blake3()
+
+    for chunk in iter(lambda: stream.read(64 * 1024), b""):
+        hasher.update(chunk)
+
+    stream.seek(0)
+    return hasher.hexdigest()
+
+# =========================
+# 🖼️ MODEL INPUT DOWNSCALING
+# =========================
+# The classifier resizes its input anyway, so send it a small JPEG copy
+# instead of the full-size photo. Storage still gets the original.
+# MODEL_MAX_DIM=0 disables this.
+MODEL_MAX_DIM = int(os.getenv("MODEL_MAX_DIM", 512))
+
+
+def model_payload(stream, mimetype):
+    if not MODEL_MAX_DIM:
+        return stream, mimetype
+
+    try:
+        image = Image.open(stream)
+
+        if max(image.size) <= MODEL_MAX_DIM:
+            stream.seek(0)
+            return stream, mimetype
+
+        # Lets the JPEG decoder scale down while decoding
+        image.draft("RGB", (MODEL_MAX_DIM, MODEL_MAX_DIM))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((MODEL_MAX_DIM, MODEL_MAX_DIM), Image.LANCZOS)
+
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        buffer.seek(0)
+
+        return buffer, "image/jpeg"
+
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        stream.seek(0)
+        return stream, mimetype
+
+# =========================
+# 🧮 LOCAL MODEL (OPTIONAL)
+# =========================
+# USE_LOCAL_MODEL=1 runs an exported (ideally INT8-quantized, see
+# quantize_model.py) ONNX classifier in-process instead of calling
+# MODEL_URL. The HTTP model stays the fallback for images the local
+# model fails on.
+# Needs the optional onnxruntime and numpy packages.
+#
+# Preprocessing must match training. It is read from the
+# preprocessor_config.json exported with the model
+# (LOCAL_MODEL_PREPROCESSOR), and any of LOCAL_MODEL_SIZE (model input
+# side), LOCAL_MODEL_RESIZE (shorter side before a center crop to
+# LOCAL_MODEL_SIZE), LOCAL_MODEL_MEAN and LOCAL_MODEL_STD
+# (comma-separated) override it. Without either, images are squashed to
+# 224x224 with ImageNet normalization.
+USE_LOCAL_MODEL = os.getenv("USE_LOCAL_MODEL") == "1"
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "model.int8.onnx")
+LOCAL_MODEL_LABELS = os.getenv("LOCAL_MODEL_LABELS", "labels.txt")
+LOCAL_MODEL_PREPROCESSOR = os.getenv("LOCAL_MODEL_PREPROCESSOR")
+
+
+def _edge(size):
+    if isinstance(size, dict):
+        return size.get("shortest_edge") or size.get("height")
+    return size
+
+
+def _floats(value):
+    return tuple(float(part) for part in value.split(","))
+
+
+def local_model_preprocessing():
+    settings = {
+        "size": 224,
+        "resize": None,
+        "mean": (0.485, 0.456, 0.406),
+        "std": (0.229, 0.224, 0.225)
+    }
+
+    if LOCAL_MODEL_PREPROCESSOR:
+        with open(LOCAL_MODEL_PREPROCESSOR, "rb") as config_file:
+            exported = orjson.loads(config_file.read())
+
+        size = _edge(exported.get("size")) or settings["size"]
+
+        if exported.get("do_center_crop") and exported.get("crop_size"):
+            settings["size"] = _edge(exported["crop_size"])
+            settings["resize"] = size
+        else:
+            settings["size"] = size
+
+        settings["mean"] = tuple(exported.get("image_mean", settings["mean"]))
+        settings["std"] = tuple(exported.get("image_std", settings["std"]))
+
+    if os.getenv("LOCAL_MODEL_SIZE"):
+        settings["size"] = int(os.getenv("LOCAL_MODEL_SIZE"))
+    if os.getenv("LOCAL_MODEL_RESIZE"):
+        settings["resize"] = int(os.getenv("LOCAL_MODEL_RESIZE"))
+    if os.getenv("LOCAL_MODEL_MEAN"):
+        settings["mean"] = _floats(os.getenv("LOCAL_MODEL_MEAN"))
+    if os.getenv("LOCAL_MODEL_STD"):
+        settings["std"] = _floats(os.getenv("LOCAL_MODEL_STD"))
+
+    return settings
+
+
+class LocalModel:
+
+    # resize=None squashes the whole image to size x size; otherwise the
+    # shorter side is scaled to resize and the center size x size kept.
+    def __init__(self, model_path, labels_path, size, resize, mean, std):
+        import numpy as np
+        import onnxruntime as ort
+
+        self.np = np
+        self.size = size
+        self.resize = resize
+        self.mean = np.array(mean, dtype=np.float32)
+        self.std = np.array(std, dtype=np.float32)
+
+        with open(labels_path) as labels_file:
+            self.labels = [line.strip() for line in labels_file if line.strip()]
+
+        if not self.labels:
+            raise Exception(f"No labels in {labels_path}")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+
+        available = ort.get_available_providers()
+        providers = [
+            provider
+            for provider in ("CUDAExecutionProvider", "CPUExecutionProvider")
+            if provider in available
+        ]
+
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=providers
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def preprocess(self, stream):
+        np = self.np
+
+        target = self.resize or self.size
+
+        image = Image.open(stream)
+        image.draft("RGB", (target, target))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+        if self.resize is None:
+            image = image.resize((self.size, self.size), Image.BILINEAR)
+        else:
+            width, height = image.size
+            scale = self.resize / min(width, height)
+            width, height = max(round(width * scale), self.size), max(round(height * scale), self.size)
+            image = image.resize((width, height), Image.BILINEAR)
+
+            left, top = (width - self.size) // 2, (height - self.size) // 2
+            image = image.crop((left, top, left + self.size, top + self.size))
+
+        pixels = np.asarray(image, dtype=np.float32) / 255.0
+        pixels = (pixels - self.mean) / self.std
+
+        return pixels.transpose(2, 0, 1)
+
+    def predict(self, stream):
+        np = self.np
+
+        batch = self.preprocess(stream)[np.newaxis]
+        logits = self.session.run(None, {self.input_name: batch})[0][0]
+
+        scores = np.exp(logits - logits.max())
+        scores /= scores.sum()
+        index = int(scores.argmax())
+
+        # Same shape as the MODEL_URL response
+        return {"label": self.labels[index], "confidence": float(scores[index])}
+
+
+# Loaded once at startup so a missing model or labels file stops the app
+# instead of failing (and being retried) on every request.
+LOCAL_MODEL = (
+    LocalModel(LOCAL_MODEL_PATH, LOCAL_MODEL_LABELS, **local_model_preprocessing())
+    if USE_LOCAL_MODEL else None
+)
+
+
+# Returns None when the local model is disabled or fails on this image,
+# so callers fall back to MODEL_URL.
+def local_prediction(stream):
+    if LOCAL_MODEL is None:
+        return None
+
+    try:
+        return LOCAL_MODEL.predict(stream)
+    except Exception as e:
+        print("❌ Local model failed, using MODEL_URL:", e)
+        stream.seek(0)
+        return None
+
 # =========================
 # 🚨 DANGEROUS ANIMAL LIST
 # =========================
@@ -45,6 +588,29 @@ DANGEROUS_ANIMALS = [
     "snake","tiger","wolf"
 ]
 
+# =========================
+# 🧠 PREDICTION PARSING
+# =========================
+# The model normally returns the confidence as a float; strings are
+# parsed and anything unparseable counts as 0 instead of failing.
+def _safe_parse(value):
+    try:
+        return float(value) * 100.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def parse_prediction(prediction):
+    animal = (prediction.get("label") or "unknown").lower()
+    confidence = prediction.get("confidence", 0.0)
+
+    if isinstance(confidence, (int, float)):
+        confidence = confidence * 100.0
+    else:
+        confidence = _safe_parse(confidence)
+
+    return animal, confidence
+
 # =========================
 # 📱 TELEGRAM ALERT FUNCTION
 # =========================
@@ -61,14 +627,12 @@ Confidence: {confidence:.2f}%
 Take precautions immediately!
 """
 
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-
         payload = {
             "chat_id": TELEGRAM_CHAT_ID,
             "text": message
         }
 
-        requests.post(url, data=payload)
+        SESSION.post(TELEGRAM_API_URL, data=payload, timeout=10)
 
         print("✅ Telegram alert sent")
 
@@ -76,6 +640,69 @@ Take precautions immediately!
         print("❌ Telegram alert failed:", e)
 
 
+# =========================
+# 📦 PREDICT MICRO-BATCHING
+# =========================
+# ENABLE_MICROBATCH=1 groups concurrent /predict calls (up to
+# MICROBATCH_SIZE, waiting at most MICROBATCH_WAIT_MS) into one POST to
+# MODEL_BATCH_URL, which takes repeated "images" fields and returns a
+# list of predictions in the same order. Up to MICROBATCH_CONCURRENCY
+# batches are in flight at once. Without MODEL_BATCH_URL nothing is
+# batched: single calls to MODEL_URL are already concurrent.
+ENABLE_MICROBATCH = os.getenv("ENABLE_MICROBATCH") == "1"
+MICROBATCH_SIZE = int(os.getenv("MICROBATCH_SIZE", 8))
+MICROBATCH_WAIT_MS = int(os.getenv("MICROBATCH_WAIT_MS", 10))
+MICROBATCH_CONCURRENCY = int(os.getenv("MICROBATCH_CONCURRENCY", 8))
+MICROBATCH_TIMEOUT = int(os.getenv("MICROBATCH_TIMEOUT", 150))
+MODEL_BATCH_URL = os.getenv("MODEL_BATCH_URL")
+
+
+def _predict_one(image):
+    filename, stream, mimetype = image
+
+    response = post_image(MODEL_URL, filename, stream, mimetype, timeout=120)
+    response.raise_for_status()
+
+    return orjson.loads(response.content)
+
+
+def _flush_predictions(images):
+
+    encoder = MultipartEncoder(
+        fields=[("images", image) for image in images]
+    )
+
+    response = SESSION.post(
+        MODEL_BATCH_URL,
+        data=encoder,
+        headers={"Content-Type": encoder.content_type},
+        timeout=120
+    )
+
+    response.raise_for_status()
+    predictions = orjson.loads(response.content)
+
+    if not isinstance(predictions, list) or len(predictions) != len(images):
+        raise ValueError("Batch model returned a mismatched response")
+
+    return predictions
+
+
+if ENABLE_MICROBATCH and MODEL_BATCH_URL:
+    BATCH_POOL = ThreadPoolExecutor(
+        max_workers=MICROBATCH_CONCURRENCY,
+        thread_name_prefix="batch"
+    )
+    PREDICT_BATCHER = MicroBatcher(
+        _flush_predictions,
+        max_batch=MICROBATCH_SIZE,
+        max_wait_ms=MICROBATCH_WAIT_MS,
+        name="predict-batcher",
+        flush_pool=BATCH_POOL
+    )
+else:
+    PREDICT_BATCHER = None
+
 # =========================
 # PREDICT ENDPOINT (AI ONLY)
 # =========================
@@ -89,77 +716,294 @@ def predict():
         return jsonify({"error": "No image uploaded"}), 400
 
     file = request.files["image"]
-    image_bytes = file.read()
-    mimetype = file.mimetype
 
     try:
-        files = {"image": (file.filename, image_bytes, mimetype)}
+        cache_key = hash_stream(file.stream)
+        idempotency_key = request.headers.get("Idempotency-Key")
 
-        response = requests.post(
-            MODEL_URL,
-            files=files,
-            timeout=120
-        )
+        if idempotency_key:
+            idempotency_key = blake3(idempotency_key.encode()).hexdigest()
+
+            with IDEMPOTENCY_LOCK:
+                entry = IDEMPOTENCY_CACHE.get(idempotency_key)
+
+            if entry is not None:
+                image_hash, result = entry
+
+                if image_hash != cache_key:
+                    return jsonify({"error": "Idempotency-Key reused with a different image"}), 422
 
-        response.raise_for_status()
-        prediction = response.json()
+                return jsonify(result), 200
 
-        animal = prediction.get("label", "Unknown").lower()
-        confidence = float(prediction.get("confidence", 0)) * 100
+        prediction = get_cached_prediction(cache_key)
+
+        if prediction is None:
+            prediction = local_prediction(file.stream)
+
+            if prediction is None:
+                stream, mimetype = model_payload(file.stream, file.mimetype)
+
+                if PREDICT_BATCHER:
+                    # Batched images are sent as bytes: a batch can still be
+                    # reading them after this request has given up and
+                    # closed its upload stream.
+                    future = PREDICT_BATCHER.submit((file.filename, stream.read(), mimetype))
+
+                    try:
+                        prediction = future.result(timeout=MICROBATCH_TIMEOUT)
+                    except FutureTimeoutError:
+                        future.cancel()
+                        return jsonify({"error": "Model batch timed out"}), 504
+                else:
+                    prediction = _predict_one((file.filename, stream, mimetype))
+
+            cache_prediction(cache_key, prediction)
+
+        animal, confidence = parse_prediction(prediction)
 
         print("🧠 Prediction:", animal, confidence)
 
         # 🚀 TELEGRAM ALERT IF DANGEROUS
+        # A backed-up Telegram API must not block predictions, so the
+        # alert is dropped when the alert queue is full.
         if animal in DANGEROUS_ANIMALS:
-            threading.Thread(
-                target=send_telegram_alert,
-                args=(animal, confidence),
-                daemon=True
-            ).start()
+            if queue_full(ALERT_POOL):
+                print("❌ Alert queue full, dropping alert for", animal)
+            else:
+                ALERT_POOL.submit(send_telegram_alert, animal, confidence)
 
-        return jsonify({
+        result = {
             "status": "success",
             "animal": animal,
             "confidence": confidence
-        }), 200
+        }
+
+        if idempotency_key:
+            with IDEMPOTENCY_LOCK:
+                IDEMPOTENCY_CACHE[idempotency_key] = (cache_key, result)
+
+        return jsonify(result), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 # =========================
-# SAVE HISTORY (UNCHANGED)
+# MODEL QUERY (IMAGE URL)
 # =========================
-@app.route("/save-history", methods=["POST"])
-def save_history():
+# image_url must pass is_bucket_url; see PREDICTION_CACHE.
+def query_model(image_url):
 
-    if "image" not in request.files:
-        return jsonify({"error": "No image uploaded"}), 400
+    prediction = get_cached_prediction(image_url)
+    if prediction is not None:
+        return prediction
 
-    file = request.files["image"]
-    animal = request.form.get("animal")
-    confidence = request.form.get("confidence")
-    user_id = request.form.get("user_id")
+    with SESSION.get(image_url, stream=True, timeout=20) as image_response:
+        image_response.raise_for_status()
 
-    if not all([animal, confidence, user_id]):
-        return jsonify({"error": "Missing required data"}), 400
+        content_length = image_response.headers.get("Content-Length")
+        content_encoding = image_response.headers.get("Content-Encoding", "identity")
+        mimetype = image_response.headers.get("Content-Type", "image/jpeg")
+
+        # Decoding locally needs the whole image; otherwise pipe it through.
+        # Content-Length only matches the raw bytes when they aren't
+        # compressed, so encoded responses are read through .content.
+        if USE_LOCAL_MODEL or MODEL_MAX_DIM:
+            stream = BytesIO(image_response.content)
+        elif content_length and content_length.isdigit() and content_encoding.lower() == "identity":
+            stream = SizedStream(image_response.raw, int(content_length))
+        else:
+            stream = image_response.content
+
+        prediction = local_prediction(stream)
+
+        if prediction is None:
+            stream, mimetype = model_payload(stream, mimetype)
+
+            with MODEL_SEMAPHORE:
+                response = post_image(
+                    MODEL_URL,
+                    "image.jpg",
+                    stream,
+                    mimetype,
+                    timeout=60
+                )
+
+            response.raise_for_status()
+            prediction = orjson.loads(response.content)
+
+    cache_prediction(image_url, prediction)
+    return prediction
+
+
+# Writes a batch of results with one RPC; if PostgREST rejects the batch,
+# each row is retried on its own so one bad row doesn't fail the others.
+# Transport errors fail the whole batch instead of fanning out into one
+# doomed request per row.
+def _flush_results(rows):
+
+    with get_supabase_pool().acquire() as supabase:
+        try:
+            supabase.rpc("process_image_results", {"p_results": rows}).execute()
+            return [None] * len(rows)
+
+        except APIError:
+            results = []
+
+            for row in rows:
+                try:
+                    supabase.rpc("process_image_result", {
+                        f"p_{key}": value for key, value in row.items()
+                    }).execute()
+                    results.append(None)
+                except Exception as e:
+                    results.append(e)
+
+            return results
+
+
+RESULT_BATCHER = MicroBatcher(
+    _flush_results,
+    max_batch=int(os.getenv("RESULT_BATCH_SIZE", 200)),
+    max_wait_ms=int(os.getenv("RESULT_BATCH_WAIT_MS", 20)),
+    name="result-batcher"
+)
+
+
+def _do_process(image_url, captured_image_id):
 
     try:
-        image_bytes = file.read()
-        mimetype = file.mimetype
-        filename = f"{int(time.time())}_{file.filename}"
+        animal, confidence = parse_prediction(query_model(image_url))
 
-        supabase.storage.from_(BUCKET_NAME).upload(
-            filename,
-            image_bytes,
-            {"content-type": mimetype}
+        print("🧠 Prediction:", animal, confidence)
+
+        RESULT_BATCHER.submit({
+            "captured_image_id": captured_image_id,
+            "animal_detected": animal,
+            "confidence_score": confidence
+        }).result()
+
+        if animal in DANGEROUS_ANIMALS:
+            send_telegram_alert(animal, confidence)
+
+    except Exception as e:
+        print("❌ Processing failed:", e)
+
+        try:
+            with get_supabase_pool().acquire() as supabase:
+                supabase.rpc("process_image_failed", {
+                    "p_captured_image_id": captured_image_id,
+                    "p_error": str(e)
+                }).execute()
+        except Exception as update_error:
+            print("❌ Status update failed:", update_error)
+
+
+# =========================
+# PROCESS IMAGE WEBHOOK
+# =========================
+# Jobs write with the service-role key, so the webhook is closed unless
+# BACKEND_SECRET_KEY is configured and the caller presents it.
+def verify_colab_secret(request_headers):
+    if not BACKEND_SECRET_KEY:
+        return False
+
+    provided_key = request_headers.get("X-Colab-Secret", "")
+    return hmac.compare_digest(provided_key.encode(), BACKEND_SECRET_KEY.encode())
+
+
+@app.route("/webhook/process-image", methods=["POST"])
+def process_image():
+
+    if not verify_colab_secret(request.headers):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    # A single job object, or a list of them when several captures are
+    # sent together; each job is processed concurrently on EXECUTOR.
+    data = request.get_json(silent=True)
+    items = data if isinstance(data, list) else [data or {}]
+
+    jobs = []
+
+    for item in items:
+        if not isinstance(item, dict):
+            return jsonify({"error": "Invalid job"}), 400
+
+        # Owner and stored URL are read from the captured_images row, so
+        # user_id is not trusted here.
+        job = (
+            item.get("image_url"),
+            item.get("captured_image_id")
         )
 
-        public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(filename)
+        if not all(job):
+            return jsonify({"error": "Missing required data"}), 400
+
+        # Only images from our own bucket are fetched, so callers can't
+        # make the server request arbitrary URLs.
+        if not is_bucket_url(job[0]):
+            return jsonify({"error": "Invalid image_url"}), 400
+
+        jobs.append(job)
+
+    if not jobs:
+        return jsonify({"error": "Missing required data"}), 400
+
+    # A batch that could never fit the queue is a client error, not a
+    # reason to retry.
+    if len(jobs) > MAX_QUEUE:
+        return jsonify({"error": f"Too many jobs, at most {MAX_QUEUE} per request"}), 413
+
+    if queue_full(EXECUTOR, len(jobs)):
+        return jsonify({"error": "Server busy, retry later"}), 503
+
+    for job in jobs:
+        EXECUTOR.submit(_do_process, *job)
+
+    return jsonify({"status": "accepted", "count": len(jobs)}), 202
+
+
+# =========================
+# SAVE HISTORY
+# =========================
+# Uploads through the Storage REST API directly: the storage client only
+# accepts bytes or real files, while httpx streams any file-like body.
+def _upload_image(filename, stream, mimetype):
+
+    response = get_supabase_pool().http_client.post(
+        f"{SUPABASE_URL}/storage/v1/object/{BUCKET_NAME}/{quote(filename)}",
+        content=stream,
+        headers={
+            "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+            "apikey": SUPABASE_SERVICE_KEY,
+            "Content-Type": mimetype,
+            "cache-control": "max-age=3600",
+            "x-upsert": "false"
+        }
+    )
+
+    response.raise_for_status()
 
+
+def _delete_image(filename):
+
+    response = get_supabase_pool().http_client.delete(
+        f"{SUPABASE_URL}/storage/v1/object/{BUCKET_NAME}/{quote(filename)}",
+        headers={
+            "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+            "apikey": SUPABASE_SERVICE_KEY
+        }
+    )
+
+    response.raise_for_status()
+
+
+def _insert_history(user_id, image_url, animal, confidence):
+
+    with get_supabase_pool().acquire() as supabase:
         captured_data = {
             "user_id": user_id,
-            "image_url": public_url,
+            "image_url": image_url,
             "status": "completed"
         }
 
@@ -168,15 +1012,64 @@ def save_history():
 
         label_data = {
             "captured_image_id": captured_id,
-            "labeled_image_url": public_url,
+            "labeled_image_url": image_url,
             "animal_detected": animal,
-            "confidence_score": float(confidence),
+            "confidence_score": confidence,
             "user_id": user_id
         }
 
         supabase.table("labeled_images").insert(label_data).execute()
 
-        return jsonify({"status": "saved","image_url": public_url}), 200
+    return captured_id
+
+
+@app.route("/save-history", methods=["POST"])
+def save_history():
+
+    if "image" not in request.files:
+        return jsonify({"error": "No image uploaded"}), 400
+
+    file = request.files["image"]
+    animal = request.form.get("animal")
+    confidence = request.form.get("confidence")
+    user_id = request.form.get("user_id")
+
+    if not all([animal, confidence, user_id]):
+        return jsonify({"error": "Missing required data"}), 400
+
+    try:
+        confidence = float(confidence)
+        mimetype = file.mimetype
+        filename = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}_{file.filename}"
+
+        # The public URL is known up front, so the rows can be inserted
+        # while the upload is still in flight.
+        image_url = public_url(BUCKET_NAME, filename)
+
+        upload = STORAGE_POOL.submit(_upload_image, filename, file.stream, mimetype)
+
+        try:
+            captured_id = _insert_history(user_id, image_url, animal, confidence)
+        except Exception:
+            # The upload still reads file.stream, so let it finish before
+            # the request closes it, then drop the image nothing points at.
+            if upload.exception() is None:
+                try:
+                    _delete_image(filename)
+                except Exception as delete_error:
+                    print("❌ Orphaned image cleanup failed:", delete_error)
+            raise
+
+        try:
+            upload.result()
+        except Exception:
+            # Don't leave history rows pointing at a missing image
+            # (labeled_images cascades from captured_images).
+            with get_supabase_pool().acquire() as supabase:
+                supabase.table("captured_images").delete().eq("id", captured_id).execute()
+            raise
+
+        return jsonify({"status": "saved","image_url": image_url}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -193,22 +1086,36 @@ def hardware_upload():
 
     file = request.files["image"]
 
-    files = {"image": (file.filename, file.read(), file.mimetype)}
-
-    response = requests.post(
+    response = post_image(
         f"{request.host_url}predict",
-        files=files
+        file.filename,
+        file.stream,
+        file.mimetype
     )
 
-    return jsonify(response.json()), 200
+    return jsonify(orjson.loads(response.content)), 200
 
 
 # =========================
 # HEALTH CHECK
 # =========================
+# Uptime probes hit this constantly, so the body is built once and
+# probes may cache it briefly.
+HEALTH_BODY = orjson.dumps({"status": "healthy"})
+HEALTH_ETAG = blake3(HEALTH_BODY).hexdigest()[:16]
+HEALTH_HEADERS = {
+    "Content-Type": "application/json",
+    "Cache-Control": "public, max-age=5",
+    "ETag": f'"{HEALTH_ETAG}"'
+}
+
+
 @app.route("/health")
 def health():
-    return jsonify({"status": "healthy"}), 200
+    if request.if_none_match.contains(HEALTH_ETAG):
+        return "", 304, HEALTH_HEADERS
+
+    return HEALTH_BODY, 200, HEALTH_HEADERS
 
 
 # =========================
@@ -0,0 +1,18 @@
+import os
+
+# =========================
+# GUNICORN CONFIG
+# =========================
+# Requests spend almost all their time waiting on the model and Supabase,
+# so concurrency comes from threads per worker rather than worker count.
+# Gunicorn picks this file up automatically: `gunicorn app:app`.
+# Caches (predictions, Idempotency-Key results) are per worker process,
+# so more workers means fewer cache hits.
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+
+keepalive = 75
+timeout = 180
@@ -0,0 +1,16 @@
+import sys
+
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+# =========================
+# INT8 MODEL QUANTIZATION
+# =========================
+# Produces the model file used with USE_LOCAL_MODEL=1 from an ONNX export
+# of the classifier:
+#   python quantize_model.py model.onnx model.int8.onnx
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python quantize_model.py <model.onnx> <model.int8.onnx>")
+
+    quantize_dynamic(sys.argv[1], sys.argv[2], weight_type=QuantType.QUInt8)
+    print("✅ Quantized model written to", sys.argv[2])
@@ -89,9 +89,23 @@ Deno.serve(async (req: Request) => {
 
     if (colabWebhookUrl) {
       try {
-        await fetch(colabWebhookUrl, {
+        // Mark as processing before the webhook call: the backend accepts
+        // the job immediately and may write 'completed' or 'failed' before
+        // fetch() resolves.
+        await supabase
+          .from('captured_images')
+          .update({ status: 'processing' })
+          .eq('id', capturedImage.id);
+
+        const webhookHeaders: Record<string, string> = { 'Content-Type': 'application/json' };
+        const backendSecretKey = Deno.env.get('BACKEND_SECRET_KEY');
+        if (backendSecretKey) {
+          webhookHeaders['X-Colab-Secret'] = backendSecretKey;
+        }
+
+        const webhookResponse = await fetch(colabWebhookUrl, {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: webhookHeaders,
           body: JSON.stringify({
             image_url: publicUrl,
             captured_image_id: capturedImage.id,
@@ -99,11 +113,16 @@ Deno.serve(async (req: Request) => {
           })
         });
 
+        if (!webhookResponse.ok) {
+          throw new Error(`Webhook returned ${webhookResponse.status}`);
+        }
+      } catch (error) {
         await supabase
           .from('captured_images')
-          .update({ status: 'processing' })
-          .eq('id', capturedImage.id);
-      } catch (error) {
+          .update({ status: 'pending' })
+          .eq('id', capturedImage.id)
+          .eq('status', 'processing');
+
         console.error('Colab webhook error:', error);
       }
     }
@@ -0,0 +1,89 @@
+/*
+  # Process Image Functions
+
+  ## Overview
+  Lets the Flask backend record a webhook result in a single round trip instead of
+  separate PostgREST calls per table.
+
+  ## New Functions
+
+  ### `process_image_result`
+  Stores the AI result for a captured image and marks it completed, atomically
+  - `p_captured_image_id` (uuid) - Captured image that was processed
+  - `p_animal_detected` (text) - Name of detected animal
+  - `p_confidence_score` (float) - AI model confidence percentage
+  - Owner and image URL are taken from the captured_images row
+  - Does nothing unless the image is still 'pending' or 'processing', so replayed
+    jobs cannot add duplicate labels
+
+  ### `process_image_failed`
+  Marks a captured image as failed and keeps the error in its metadata
+  - `p_captured_image_id` (uuid) - Captured image that failed
+  - `p_error` (text) - Error message
+  - Does nothing unless the image is still 'pending' or 'processing'
+
+  ## Security
+  - Only the service role may execute these functions
+*/
+
+CREATE OR REPLACE FUNCTION process_image_result(
+  p_captured_image_id uuid,
+  p_animal_detected text,
+  p_confidence_score float
+)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_user_id uuid;
+  v_image_url text;
+BEGIN
+  -- The row lock taken here serializes concurrent results for the same image
+  UPDATE captured_images
+  SET status = 'completed'
+  WHERE id = p_captured_image_id
+    AND status IN ('pending', 'processing')
+  RETURNING user_id, image_url INTO v_user_id, v_image_url;
+
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO labeled_images (
+    captured_image_id,
+    user_id,
+    labeled_image_url,
+    animal_detected,
+    confidence_score
+  )
+  VALUES (
+    p_captured_image_id,
+    v_user_id,
+    v_image_url,
+    p_animal_detected,
+    p_confidence_score
+  );
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION process_image_failed(
+  p_captured_image_id uuid,
+  p_error text
+)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE captured_images
+  SET status = 'failed',
+      metadata = COALESCE(metadata, '{}'::jsonb) || jsonb_build_object('error', p_error)
+  WHERE id = p_captured_image_id
+    AND status IN ('pending', 'processing');
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION process_image_result(uuid, text, float) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION process_image_failed(uuid, text) FROM PUBLIC, anon, authenticated;
+
+GRANT EXECUTE ON FUNCTION process_image_result(uuid, text, float) TO service_role;
+GRANT EXECUTE ON FUNCTION process_image_failed(uuid, text) TO service_role;
@@ -0,0 +1,57 @@
+/*
+  # Batched Process Image Results
+
+  ## Overview
+  Lets the Flask backend flush many webhook results in one round trip.
+
+  ## New Functions
+
+  ### `process_image_results`
+  Bulk version of `process_image_result`
+  - `p_results` (jsonb) - Array of objects with `captured_image_id`,
+    `animal_detected` and `confidence_score`
+  - Marks every referenced captured image that is still 'pending' or 'processing'
+    completed with a single UPDATE
+  - Inserts one labeled_images row per image it completed, with owner and URL
+    taken from the captured_images row
+
+  ## Security
+  - Only the service role may execute this function
+*/
+
+CREATE OR REPLACE FUNCTION process_image_results(p_results jsonb)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  WITH results AS (
+    SELECT *
+    FROM jsonb_to_recordset(p_results) AS r(
+      captured_image_id uuid,
+      animal_detected text,
+      confidence_score float
+    )
+  ),
+  completed AS (
+    UPDATE captured_images AS c
+    SET status = 'completed'
+    FROM results AS r
+    WHERE c.id = r.captured_image_id
+      AND c.status IN ('pending', 'processing')
+    RETURNING c.id, c.user_id, c.image_url, r.animal_detected, r.confidence_score
+  )
+  INSERT INTO labeled_images (
+    captured_image_id,
+    user_id,
+    labeled_image_url,
+    animal_detected,
+    confidence_score
+  )
+  SELECT id, user_id, image_url, animal_detected, confidence_score
+  FROM completed;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION process_image_results(jsonb) FROM PUBLIC, anon, authenticated;
+
+GRANT EXECUTE ON FUNCTION process_image_results(jsonb) TO service_role;